@@ -3,7 +3,7 @@ import streamlit as st
 from streamlit_webrtc import webrtc_streamer, VideoTransformerBase, WebRtcMode
 import av, cv2
 
-from utils.session_state import init_state, save_game_state
+from utils.session_state import init_state, save_game_state, cached_result, log_rerun, in_app_run
 from models.chatbot_service import TutorBot
 from models import adaptive_engine
 from models.emotion_service import predict_emotion_from_frame
@@ -12,12 +12,6 @@ from models.speech_to_text import record_audio, transcribe_file
 from models.text_to_speech_service import synthesize_tts
 
 st.set_page_config(page_title="Adaptive English Coach", page_icon="🧠", layout="wide")
-init_state(st)
-
-# Tutor singleton
-if st.session_state.tutorbot is None:
-    st.session_state.tutorbot = TutorBot()
-
 # ===== Live Emotion (auto-playing) =====
 class EmotionTransformer(VideoTransformerBase):
     def __init__(self):
@@ -33,22 +27,30 @@ class EmotionTransformer(VideoTransformerBase):
             cv2.putText(img, label, (10,30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0,200,0), 2, cv2.LINE_AA)
         return img
 
-# Try to start automatically (user will still need to allow camera once)
-ctx = webrtc_streamer(
-    key="emotion",
-    mode=WebRtcMode.SENDRECV,
-    desired_playing_state=True,             # <-- auto-start
-    media_stream_constraints={"video": True, "audio": False},
-    video_transformer_factory=EmotionTransformer,
-    async_processing=True,
-    video_html_attrs={"autoPlay": True, "muted": True, "playsInline": True}
-)
+def start_emotion_stream():
+    # Try to start automatically (user will still need to allow camera once)
+    return webrtc_streamer(
+        key="emotion",
+        mode=WebRtcMode.SENDRECV,
+        desired_playing_state=True,             # <-- auto-start
+        media_stream_constraints={"video": True, "audio": False},
+        video_transformer_factory=EmotionTransformer,
+        async_processing=True,
+        video_html_attrs={"autoPlay": True, "muted": True, "playsInline": True}
+    )
 
 def get_live_emotion():
     if ctx and ctx.video_transformer and ctx.video_transformer.last_emotion:
         st.session_state.current_emotion = ctx.video_transformer.last_emotion
     return st.session_state.current_emotion
 
+def live_emotion_this_run():
+    # A full run reads the stream once at the top of the page; only a
+    # fragment-only rerun needs its own read
+    if in_app_run(st):
+        return st.session_state.current_emotion
+    return get_live_emotion()
+
 # ===== Helpers =====
 def update_gamification(correct, total):
     gs = st.session_state.game_state
@@ -61,11 +63,11 @@ def update_gamification(correct, total):
     else: gs["leaderboard"].append({"name":"You","xp":gs["xp"]})
     save_game_state(gs)
 
-def generate_quiz_now():
+def generate_quiz_now(emotion):
     info = adaptive_engine.get_topic_info(
         current_topic=st.session_state.current_topic,
         user_results=st.session_state.user_results,
-        emotion=get_live_emotion()
+        emotion=emotion
     )
     diff = info["base_difficulty"]
     q = st.session_state.tutorbot.generate_quiz(
@@ -77,11 +79,11 @@ def generate_quiz_now():
     st.session_state.quiz_answers = [None]*len(q)
     return info
 
-def refresh_teaching_block():
+def refresh_teaching_block(emotion):
     info = adaptive_engine.get_topic_info(
         current_topic=st.session_state.current_topic,
         user_results=st.session_state.user_results,
-        emotion=get_live_emotion()
+        emotion=emotion
     )
     st.session_state.teaching_block = st.session_state.tutorbot.generate_teaching_block(
         topic=st.session_state.current_topic,
@@ -89,111 +91,171 @@ def refresh_teaching_block():
         level_hint=info["model_level"],
     )
 
-# ===== Sidebar =====
-with st.sidebar:
-    gs = st.session_state.game_state
-    st.metric("Streak (days)", gs["streak_days"])
-    st.metric("XP", gs["xp"])
-    st.caption(f"Emotion: {get_live_emotion() or '—'}")
+def tts_audio_bytes(key, text, lang):
+    # Keyed on (text, lang) so reruns replay the stored bytes instead of hitting gTTS/disk
+    def _synth():
+        p = synthesize_tts(text, lang=lang)
+        with open(p, "rb") as f: return f.read()
+    return cached_result(st, key, (text, lang), _synth)
 
-# ===== Tabs =====
-tabs = st.tabs(["📘 Learn", "📝 Assessment", "💬 Chat", "🎙 Speak", "🛠 Grammar", "🌐 Translate"])
+# ===== Tabs (each one is a fragment: its widgets rerun only that tab) =====
 
 # --- Learn ---
-with tabs[0]:
-    st.subheader(f"Current Topic • {st.session_state.current_topic} (starts A1)")
-    col1, col2 = st.columns([3,1])
-    with col1:
-        if st.button("Load/Refresh Lesson", use_container_width=True):
-            refresh_teaching_block()
-        st.write(st.session_state.teaching_block or "Click to load lesson content.")
-    with col2:
-        st.write("Live Emotion:", get_live_emotion() or "Detecting…")
+@st.fragment
+def learn_tab():
+    with log_rerun(st, "learn"):
+        emotion = live_emotion_this_run()
+        st.subheader(f"Current Topic • {st.session_state.current_topic} (starts A1)")
+        col1, col2 = st.columns([3,1])
+        with col1:
+            if st.button("Load/Refresh Lesson", use_container_width=True):
+                refresh_teaching_block(emotion)
+            st.write(st.session_state.teaching_block or "Click to load lesson content.")
+        with col2:
+            st.write("Live Emotion:", emotion or "Detecting…")
 
 # --- Assessment (auto new quiz always) ---
-with tabs[1]:
-    st.subheader("Adaptive Quiz (emotion-aware)")
-    if st.session_state.quiz_data is None:
-        generate_quiz_now()
-    if st.session_state.quiz_data:
-        for i, q in enumerate(st.session_state.quiz_data):
-            st.markdown(f"**Q{i+1}. {q['question']}**")
-            opts = [f"{j+1}. {opt}" for j, opt in enumerate(q["options"])]
-            cur = st.session_state.quiz_answers[i]
-            st.session_state.quiz_answers[i] = st.radio(
-                "Choose one:", opts,
-                index=(opts.index(cur) if cur in opts else 0),
-                key=f"q_{i}"
-            )
-            st.divider()
-
-    # Submit always regenerates a new quiz (right OR wrong)
-    if st.button("Submit & Next Quiz", use_container_width=True):
-        total = len(st.session_state.quiz_data or [])
-        correct = 0
-        res = []
-        for i, q in enumerate(st.session_state.quiz_data or []):
-            sel = st.session_state.quiz_answers[i]
-            idx = int(sel.split(".")[0]) - 1
-            ok = 1 if idx == q["answer_index"] else 0
-            res.append(ok); correct += ok
-        st.session_state.user_results = res
-        update_gamification(correct, total)
-        info = generate_quiz_now()      # ← ALWAYS regenerate
-        refresh_teaching_block()        # refresh learn content
-        st.success(f"Round score: {correct}/{total}")
-        st.info(info["coach_message"])
+@st.fragment
+def assessment_tab():
+    with log_rerun(st, "assessment"):
+        emotion = live_emotion_this_run()
+        st.subheader("Adaptive Quiz (emotion-aware)")
+        if st.session_state.quiz_data is None:
+            generate_quiz_now(emotion)
+        # Shown once, right after the round was scored
+        if st.session_state.quiz_feedback:
+            score, coach_message = st.session_state.quiz_feedback
+            st.session_state.quiz_feedback = None
+            st.success(score)
+            st.info(coach_message)
+
+        # A form so picking an answer does not rerun anything until submit
+        with st.form(f"quiz_{st.session_state.quiz_round}"):
+            for i, q in enumerate(st.session_state.quiz_data or []):
+                st.markdown(f"**Q{i+1}. {q['question']}**")
+                opts = [f"{j+1}. {opt}" for j, opt in enumerate(q["options"])]
+                st.session_state.quiz_answers[i] = st.radio(
+                    "Choose one:", opts, index=0,
+                    key=f"q_{st.session_state.quiz_round}_{i}"
+                )
+                st.divider()
+
+            # Submit always regenerates a new quiz (right OR wrong)
+            submitted = st.form_submit_button("Submit & Next Quiz", use_container_width=True)
+
+        if submitted:
+            total = len(st.session_state.quiz_data or [])
+            correct = 0
+            res = []
+            for i, q in enumerate(st.session_state.quiz_data or []):
+                sel = st.session_state.quiz_answers[i]
+                idx = int(sel.split(".")[0]) - 1
+                ok = 1 if idx == q["answer_index"] else 0
+                res.append(ok); correct += ok
+            st.session_state.user_results = res
+            update_gamification(correct, total)
+            info = generate_quiz_now(emotion)      # ← ALWAYS regenerate
+            refresh_teaching_block(emotion)        # refresh learn content
+            st.session_state.quiz_round += 1
+            st.session_state.quiz_feedback = (f"Round score: {correct}/{total}", info["coach_message"])
+            st.rerun()                      # full rerun: sidebar XP and Learn tab changed too
 
 # --- Chat ---
-with tabs[2]:
-    msg = st.text_input("Ask your tutor:")
-    if st.button("Send"):
-        if msg.strip():
-            ans = st.session_state.tutorbot.chat(msg.strip())
-            st.write("**Tutor:**", ans)
+@st.fragment
+def chat_tab():
+    with log_rerun(st, "chat"):
+        msg = st.text_input("Ask your tutor:")
+        if st.button("Send"):
+            if msg.strip():
+                st.session_state.chat_reply = st.session_state.tutorbot.chat(msg.strip())
+        if st.session_state.chat_reply:
+            st.write("**Tutor:**", st.session_state.chat_reply)
 
 # --- Speak ---
-with tabs[3]:
-    st.subheader("Speak & Practice")
-    secs = st.slider("Record seconds:", 3, 15, 5)
-    lang_in = st.selectbox("You will speak in:", ["en","hi","mr"], index=0)
-    if st.button("Record Now"):
-        wav = record_audio(secs)
-        text = transcribe_file(wav, language_code=lang_in)
+@st.fragment
+def speak_tab():
+    with log_rerun(st, "speak"):
+        st.subheader("Speak & Practice")
+        secs = st.slider("Record seconds:", 3, 15, 5)
+        lang_in = st.selectbox("You will speak in:", ["en","hi","mr"], index=0)
+        if st.button("Record Now"):
+            wav = record_audio(secs)
+            st.session_state.speak_transcript = transcribe_file(wav, language_code=lang_in) or ""
+
+        text = st.session_state.speak_transcript
+        if text is None:
+            return
         st.write("Transcript:", text or "—")
         if text.strip():
-            corr = correct_sentence(text)
+            corr = cached_result(st, "speak_correction", text, lambda: correct_sentence(text))
             st.write("Corrected:", corr)
             tts_lang = st.selectbox("Listen in:", ["en","hi","mr"], index=0, key="tts1")
             if corr.strip():
-                p = synthesize_tts(corr, lang=tts_lang)
-                with open(p, "rb") as f: st.audio(f.read(), format="audio/mp3")
+                st.audio(tts_audio_bytes("speak_tts", corr, tts_lang), format="audio/mp3")
         else:
             st.warning("No speech detected. Try again closer to the mic.")
 
 # --- Grammar ---
-with tabs[4]:
-    txt = st.text_area("Enter English text:")
-    if st.button("Correct Grammar"):
-        if txt.strip():
-            corr = correct_sentence(txt.strip())
+@st.fragment
+def grammar_tab():
+    with log_rerun(st, "grammar"):
+        txt = st.text_area("Enter English text:")
+        if st.button("Correct Grammar"):
+            if txt.strip():
+                st.session_state.grammar_input = txt.strip()
+            else:
+                st.session_state.grammar_input = None
+                st.warning("Please type something.")
+
+        src_txt = st.session_state.grammar_input
+        if src_txt:
+            corr = cached_result(st, "grammar_correction", src_txt, lambda: correct_sentence(src_txt))
             st.subheader("Corrected")
             st.write(corr)
             st.subheader("Changes")
-            st.write(highlight_corrections(txt.strip(), corr))
-        else:
-            st.warning("Please type something.")
+            st.write(highlight_corrections(src_txt, corr))
 
 # --- Translate ---
-with tabs[5]:
-    src = st.selectbox("From", ["English","Hindi","Marathi"], index=0)
-    tgt = st.selectbox("To",   ["English","Hindi","Marathi"], index=1)
-    ttxt = st.text_area("Text:")
-    if st.button("Translate"):
-        tr = st.session_state.tutorbot.translate(ttxt, src, tgt)
+@st.fragment
+def translate_tab():
+    with log_rerun(st, "translate"):
+        src = st.selectbox("From", ["English","Hindi","Marathi"], index=0)
+        tgt = st.selectbox("To",   ["English","Hindi","Marathi"], index=1)
+        ttxt = st.text_area("Text:")
+        if st.button("Translate"):
+            st.session_state.translate_request = (ttxt, src, tgt)
+
+        req = st.session_state.translate_request
+        if req is None:
+            return
+        tr = cached_result(st, "translation", req, lambda: st.session_state.tutorbot.translate(*req))
         st.subheader("Translation")
         st.write(tr)
         tts_lang2 = st.selectbox("Speak result in:", ["en","hi","mr"], index=0, key="tts2")
         if tr.strip():
-            p2 = synthesize_tts(tr, lang=tts_lang2)
-            with open(p2, "rb") as f: st.audio(f.read(), format="audio/mp3")
+            st.audio(tts_audio_bytes("translate_tts", tr, tts_lang2), format="audio/mp3")
+
+# ===== Page =====
+with log_rerun(st, "app"):
+    init_state(st)
+
+    # Tutor singleton
+    if st.session_state.tutorbot is None:
+        st.session_state.tutorbot = TutorBot()
+
+    ctx = start_emotion_stream()
+    live_emotion = get_live_emotion()
+
+    with st.sidebar:
+        gs = st.session_state.game_state
+        st.metric("Streak (days)", gs["streak_days"])
+        st.metric("XP", gs["xp"])
+        st.caption(f"Emotion: {live_emotion or '—'}")
+
+    tabs = st.tabs(["📘 Learn", "📝 Assessment", "💬 Chat", "🎙 Speak", "🛠 Grammar", "🌐 Translate"])
+    with tabs[0]: learn_tab()
+    with tabs[1]: assessment_tab()
+    with tabs[2]: chat_tab()
+    with tabs[3]: speak_tab()
+    with tabs[4]: grammar_tab()
+    with tabs[5]: translate_tab()
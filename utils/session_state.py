@@ -1,6 +1,16 @@
 # utils/session_state.py
-import json, os
+import json, os, time, logging
+from contextlib import contextmanager
+
 GAME_STATE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "game_state.json")
+# Rerun timings go to this logger only; the root logger is left alone
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(levelname)s %(message)s"))
+    logger.addHandler(_handler)
 
 def load_game_state():
     with open(GAME_STATE_PATH, "r", encoding="utf-8") as f:
@@ -19,15 +29,79 @@ def init_state(st):
         st.session_state.quiz_data = None
     if "quiz_answers" not in st.session_state:
         st.session_state.quiz_answers = None
+    if "quiz_round" not in st.session_state:
+        st.session_state.quiz_round = 0
+    if "quiz_feedback" not in st.session_state:
+        st.session_state.quiz_feedback = None
     if "user_results" not in st.session_state:
         st.session_state.user_results = []
     if "current_emotion" not in st.session_state:
         st.session_state.current_emotion = None
     if "chat_history" not in st.session_state:
         st.session_state.chat_history = []
+    if "chat_reply" not in st.session_state:
+        st.session_state.chat_reply = None
     # Start from basic A1 topic on first run
     if "current_topic" not in st.session_state:
         # Use a guaranteed A1 item if present in your roadmap; else fallback text
         st.session_state.current_topic = st.session_state.game_state.get("current_topic", "A1: Greetings and Introductions")
     if "teaching_block" not in st.session_state:
         st.session_state.teaching_block = None
+    # Raw inputs captured by button clicks; results are derived from them on every rerun
+    if "speak_transcript" not in st.session_state:
+        st.session_state.speak_transcript = None
+    if "grammar_input" not in st.session_state:
+        st.session_state.grammar_input = None
+    if "translate_request" not in st.session_state:
+        st.session_state.translate_request = None
+
+# ===== Rerun-aware results =====
+def cached_result(st, key, inputs, compute):
+    """
+    Return the result stored under `key` if it was computed from the same
+    `inputs`; otherwise call `compute()` and store the new result.
+    """
+    entry = st.session_state.get(key)
+    if entry is not None and entry["inputs"] == inputs:
+        return entry["value"]
+    value = compute()
+    st.session_state[key] = {"inputs": inputs, "value": value}
+    return value
+
+def in_app_run(st):
+    """True while a full script run (not a fragment-only rerun) is executing."""
+    return bool(st.session_state.get("_in_app_run"))
+
+def start_rerun(st, scope="app"):
+    """
+    Start counting and timing one rerun of `scope` ("app" for a full script
+    run, the fragment name for a fragment-only rerun). Fragments executed as
+    part of a full run are already covered by the "app" timing and are not
+    counted. Returns a handle for finish_rerun().
+    """
+    if scope == "app":
+        st.session_state["_in_app_run"] = True
+    elif in_app_run(st):
+        return None
+    counts = st.session_state.setdefault("rerun_counts", {})
+    counts[scope] = counts.get(scope, 0) + 1
+    return scope, counts[scope], time.perf_counter()
+
+def finish_rerun(st, run):
+    if run is None:
+        return
+    scope, n, t0 = run
+    if scope == "app":
+        st.session_state["_in_app_run"] = False
+    ms = (time.perf_counter() - t0) * 1000
+    logger.info("rerun %s #%d took %.1f ms", scope, n, ms)
+
+@contextmanager
+def log_rerun(st, scope):
+    # finally: an exception, st.stop() or an interrupted run must still clear
+    # the "app" flag, or later fragment-only reruns would go uncounted
+    run = start_rerun(st, scope)
+    try:
+        yield
+    finally:
+        finish_rerun(st, run)